@@ -1,56 +1,506 @@
+import asyncio
+import functools
+import hashlib
 import json
 import os
-import tempfile
+import re
+import secrets
+import shutil
+import threading
+import time
 import uuid
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import librosa
+import httpx
+import orjson
+import soundfile as sf
 import torch
+import torchaudio
+import torchaudio.functional as AF
 from dotenv import load_dotenv
 from elevenlabs import VoiceSettings
 from elevenlabs.client import ElevenLabs
 from fastapi import HTTPException, UploadFile
-from openai import OpenAI
-from rag_service import rag_service
+from openai import AsyncOpenAI, OpenAI
+from rag_service import InterviewType, get_rag_service
 from transformers import WhisperForConditionalGeneration, WhisperProcessor
 
 load_dotenv()
 
+# Satu pool koneksi HTTP/2 keep-alive untuk semua panggilan OpenAI (chat & TTS)
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+    timeout=30,
+)
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client
+)
+
+# Batas panggilan LLM yang berjalan bersamaan di semua endpoint (rate limit OpenAI)
+llm_semaphore = asyncio.Semaphore(32)
+
+
+def load_audio(audio_file, sampling_rate=16000):
+    # audio_file bisa path atau file-like (mis. file dari UploadFile)
+    try:
+        audio, sample_rate = sf.read(audio_file, dtype="float32", always_2d=False)
+        audio = torch.from_numpy(audio)
+        if audio.ndim > 1:
+            audio = audio.mean(dim=1)
+    except sf.LibsndfileError:
+        # Rekaman MediaRecorder (webm/opus) tidak didukung libsndfile
+        if hasattr(audio_file, "seek"):
+            audio_file.seek(0)
+        audio, sample_rate = torchaudio.load(audio_file)
+        audio = audio.mean(dim=0)
+
+    if sample_rate != sampling_rate:
+        audio = AF.resample(audio, sample_rate, sampling_rate)
+    return audio.numpy()
+
+
+# Batch terbesar yang dikirim BatchedWhisperRunner, juga batas warmup compile
+WHISPER_MAX_BATCH_SIZE = 8
+
+
+@functools.lru_cache(maxsize=4)
+def _load_whisper(model_name, device):
+    # Satu salinan bobot per (model, device) untuk seluruh proses
+    processor = WhisperProcessor.from_pretrained(model_name)
+    model = WhisperForConditionalGeneration.from_pretrained(model_name)
+    # FP16 di GPU supaya GEMM jalan di tensor core, FP32 di CPU
+    model = model.to(
+        device, dtype=torch.float16 if device == "cuda" else torch.float32
+    ).eval()
+    if device == "cuda":
+        # KV cache statis supaya shape graph tidak berubah di setiap step
+        # decoding (tanpa ini torch.compile terus recompile & re-record graph)
+        model.generation_config.cache_implementation = "static"
+        # CUDA graphs menghilangkan overhead launch kernel per step decoding
+        model.forward = torch.compile(
+            model.forward, mode="reduce-overhead", fullgraph=False
+        )
+    return processor, model
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+async def _hold_llm_slot(tokens):
+    # Request streaming baru dikirim saat token pertama diminta, jadi slot
+    # llm_semaphore dipegang sampai stream habis, bukan hanya saat dibuat
+    async with llm_semaphore:
+        async for token in tokens:
+            yield token
+
 
 class TranscriptionClient:
-    def transcribe(self, audio_file_path, language="id"):
+    def transcribe(self, audio_file, language="id"):
         raise NotImplementedError("This method should be overridden in subclasses")
 
 
 class HuggingFaceWhisperClient(TranscriptionClient):
-    def __init__(self, model_name="openai/whisper-small", device="cpu"):
-        self.processor = WhisperProcessor.from_pretrained(model_name)
-        self.model = WhisperForConditionalGeneration.from_pretrained(model_name)
+    def __init__(self, model_name="openai/whisper-small", device=None):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
         self.device = torch.device(device)
-        self.model.to(self.device)
+        self.processor, self.model = _load_whisper(model_name, self.device.type)
+        self._configure_generation()
+        # CUDA graph tree torch.compile disimpan per thread (threading.local),
+        # jadi warmup dan semua inferensi harus jalan di satu thread yang sama
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        if self.device.type == "cuda":
+            self.executor.submit(self._warmup).result()
         print(f"Model berjalan di {self.device.type.upper()}.")
 
-    def transcribe(self, audio_file_path, language="id"):
+    def _warmup(self):
+        # Bayar biaya compile saat startup, bukan di request pertama, untuk
+        # setiap ukuran batch yang bisa dikirim BatchedWhisperRunner
+        for batch_size in range(1, WHISPER_MAX_BATCH_SIZE + 1):
+            self.generate(torch.zeros(batch_size, self.model.config.num_mel_bins, 3000))
+
+    def _configure_generation(self, language="id"):
+        # Prompt decoder untuk bahasa default di-set sekali di generation_config,
+        # jadi generate() tidak perlu kwargs untuk request biasa
+        self.default_language = language
+        self._decoder_prompt_ids = {
+            language: self.processor.get_decoder_prompt_ids(
+                language=language, task="transcribe"
+            )
+        }
+        generation_config = self.model.generation_config
+        generation_config.forced_decoder_ids = self._decoder_prompt_ids[language]
+        generation_config.num_beams = 1
+        generation_config.max_new_tokens = 128
+        generation_config.use_cache = True
+
+    def get_decoder_prompt_ids(self, language):
+        if language not in self._decoder_prompt_ids:
+            self._decoder_prompt_ids[language] = self.processor.get_decoder_prompt_ids(
+                language=language, task="transcribe"
+            )
+        return self._decoder_prompt_ids[language]
+
+    def _generate_kwargs(self, language):
+        if language == self.default_language:
+            return {}
+        return {"forced_decoder_ids": self.get_decoder_prompt_ids(language)}
+
+    def extract_features(self, audios):
+        # STFT + mel untuk seluruh batch (B, T) dijalankan sekali di device model
+        return self.processor(
+            audios,
+            sampling_rate=16000,
+            return_tensors="pt",
+            device=str(self.device),
+        ).input_features
+
+    def generate(self, input_features, language="id"):
+        input_features = input_features.to(self.device, dtype=self.model.dtype)
+        with torch.inference_mode(), torch.autocast(
+            device_type=self.device.type,
+            dtype=torch.float16,
+            enabled=self.device.type == "cuda",
+        ):
+            generated_ids = self.model.generate(
+                input_features, **self._generate_kwargs(language)
+            )
+
+        return self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def transcribe_batch(self, audios, language="id"):
+        return self.generate(self.extract_features(audios), language)
+
+    def transcribe(self, audio_file, language="id"):
+        try:
+            audio_input = load_audio(audio_file)
+            return self.transcribe_batch([audio_input], language)[0]
+
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error in transcription: {str(e)}"
+            )
+
+
+class ORTWhisperClient(HuggingFaceWhisperClient):
+    """Whisper via ONNX Runtime CUDA dengan IO binding.
+
+    Encoder output dan KV cache decoder tetap di GPU selama decoding, jadi
+    tidak ada copy host<->device per step. Hasil export ONNX disimpan di
+    ``ORT_MODEL_DIR`` supaya export hanya terjadi sekali.
+    """
+
+    def __init__(self, model_name="openai/whisper-small", model_dir=None):
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+        model_dir = Path(model_dir or os.getenv("ORT_MODEL_DIR", "whisper_onnx"))
+        exported = model_dir.exists()
+
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        self.model = ORTModelForSpeechSeq2Seq.from_pretrained(
+            model_dir if exported else model_name,
+            export=not exported,
+            provider="CUDAExecutionProvider",
+            use_io_binding=True,
+        )
+        if not exported:
+            self.model.save_pretrained(model_dir)
+
+        self.device = self.model.device
+        self._configure_generation()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        print(f"Model ONNX Runtime berjalan di {self.device.type.upper()}.")
+
+    def generate(self, input_features, language="id"):
+        generated_ids = self.model.generate(
+            input_features.to(self.device), **self._generate_kwargs(language)
+        )
+
+        return self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+
+class FasterWhisperClient(TranscriptionClient):
+    """Whisper via faster-whisper (CTranslate2) dengan BatchedInferencePipeline.
+
+    Di GPU bobot dijalankan sebagai INT8 dengan aktivasi FP16
+    (``int8_float16``), di CPU sebagai INT8. Potongan 30 detik dari satu audio
+    di-decode sekaligus dalam satu batch.
+    """
+
+    def __init__(self, model_name="small", device=None, batch_size=16):
+        from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+        self.model = WhisperModel(model_name, device=device, compute_type=compute_type)
+        self.pipeline = BatchedInferencePipeline(model=self.model)
+        self.batch_size = batch_size
+        print(f"Model faster-whisper berjalan di {device.upper()} ({compute_type}).")
+
+    def transcribe(self, audio_file, language="id"):
+        audio_input = load_audio(audio_file)
+        segments, _ = self.pipeline.transcribe(
+            audio_input,
+            language=language,
+            beam_size=1,
+            batch_size=self.batch_size,
+        )
+
+        return "".join(segment.text for segment in segments).strip()
+
+
+async def collect_batch(queue, max_batch_size, max_wait):
+    # Tunggu item pertama, lalu kumpulkan sisanya maksimal max_wait detik
+    loop = asyncio.get_running_loop()
+    items = [await queue.get()]
+    deadline = loop.time() + max_wait
+
+    while len(items) < max_batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
         try:
-            audio_input, sample_rate = librosa.load(audio_file_path, sr=16000)
+            items.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return items
+
+
+class BatchedWhisperRunner:
+    """Menggabungkan request transkripsi yang datang bersamaan jadi satu batch.
+
+    Request dikumpulkan maksimal ``max_wait`` detik atau ``max_batch_size``
+    item, lalu dibagi ke dua bucket durasi (< 10 detik dan 10-30 detik) supaya
+    decoder tidak menunggu audio yang jauh lebih panjang.
+    """
+
+    # Batas bucket audio pendek, dalam detik
+    SHORT_AUDIO_SECONDS = 10
+
+    def __init__(self, client, max_batch_size=WHISPER_MAX_BATCH_SIZE, max_wait=0.05):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, audio_input, language="id"):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        is_long = len(audio_input) >= self.SHORT_AUDIO_SECONDS * 16000
+        bucket = (language, is_long)
+        await self._queue.put((bucket, audio_input, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            buckets = {}
+            items = await collect_batch(self._queue, self.max_batch_size, self.max_wait)
+            for bucket, audio_input, future in items:
+                buckets.setdefault(bucket, []).append((audio_input, future))
+
+            for (language, _), items in buckets.items():
+                futures = [future for _, future in items]
+                try:
+                    # Selalu di thread milik client, bukan default executor
+                    transcriptions = await asyncio.get_running_loop().run_in_executor(
+                        self.client.executor,
+                        self.client.transcribe_batch,
+                        [audio_input for audio_input, _ in items],
+                        language,
+                    )
+                except Exception as e:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for future, transcription in zip(futures, transcriptions):
+                    if not future.done():
+                        future.set_result(transcription)
+
+
+class TRTWhisperClient(TranscriptionClient):
+    """Whisper via engine TensorRT-LLM (encoder + decoder, FP16).
+
+    Engine dibangun sekali secara offline dengan ``build.py`` dari
+    ``examples/whisper`` TensorRT-LLM, lalu diarahkan lewat ``TRT_ENGINE_DIR``.
+    Engine INT8 (``TRT_INT8_ENGINE_DIR``) dipakai otomatis di GPU SM >= 7.5.
+    """
+
+    # Engine di-cache per direktori supaya tidak di-deserialize ulang. Session
+    # TensorRT stateful, jadi setiap engine punya lock sendiri
+    _sessions = {}
+
+    def __init__(self, engine_dir=None, model_name="openai/whisper-small"):
+        import tensorrt_llm
+        from tensorrt_llm.runtime import GenerationSession, ModelConfig, Session
+
+        self.engine_dir = Path(engine_dir or self._default_engine_dir())
+        if not self.engine_dir.exists():
+            raise RuntimeError(
+                f"TensorRT engine dir '{self.engine_dir}' does not exist"
+            )
 
-            input_features = self.processor(
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        self.tokenizer = self.processor.tokenizer
+        self.eot_id = self.tokenizer.convert_tokens_to_ids("<|endoftext|>")
+
+        with open(self.engine_dir / "encoder_config.json") as f:
+            encoder_config = json.load(f)
+        with open(self.engine_dir / "decoder_config.json") as f:
+            raw_decoder_config = json.load(f)
+        decoder_config = {
+            **raw_decoder_config["plugin_config"],
+            **raw_decoder_config["builder_config"],
+        }
+        self.dtype = encoder_config["builder_config"]["precision"]
+
+        key = str(self.engine_dir.resolve())
+        if key not in self._sessions:
+            with open(
+                self.engine_dir / f"whisper_encoder_{self.dtype}_tp1_rank0.engine", "rb"
+            ) as f:
+                encoder_session = Session.from_serialized_engine(f.read())
+
+            with open(
+                self.engine_dir
+                / f"whisper_decoder_{decoder_config['precision']}_tp1_rank0.engine",
+                "rb",
+            ) as f:
+                decoder_engine_buffer = f.read()
+
+            decoder_model_config = ModelConfig(
+                max_batch_size=decoder_config["max_batch_size"],
+                max_beam_width=decoder_config["max_beam_width"],
+                num_heads=decoder_config["num_heads"],
+                num_kv_heads=decoder_config["num_heads"],
+                hidden_size=decoder_config["hidden_size"],
+                vocab_size=decoder_config["vocab_size"],
+                num_layers=decoder_config["num_layers"],
+                gpt_attention_plugin=decoder_config["gpt_attention_plugin"],
+                remove_input_padding=decoder_config["remove_input_padding"],
+                cross_attention=decoder_config["cross_attention"],
+                has_position_embedding=decoder_config["has_position_embedding"],
+                has_token_type_embedding=decoder_config["has_token_type_embedding"],
+            )
+            decoder_session = GenerationSession(
+                decoder_model_config,
+                decoder_engine_buffer,
+                tensorrt_llm.Mapping(world_size=1, rank=0),
+            )
+            self._sessions[key] = (encoder_session, decoder_session, threading.Lock())
+
+        self.encoder_session, self.decoder_session, self._lock = self._sessions[key]
+        print(f"Model TensorRT berjalan dari {self.engine_dir} ({self.dtype}).")
+
+    @staticmethod
+    def _default_engine_dir():
+        # Tensor core INT8 baru tersedia mulai Turing (SM 7.5), GPU lama pakai FP16
+        int8_engine_dir = os.getenv("TRT_INT8_ENGINE_DIR")
+        if int8_engine_dir and torch.cuda.get_device_capability() >= (7, 5):
+            return int8_engine_dir
+        return os.getenv("TRT_ENGINE_DIR", "whisper_trt")
+
+    def _decoder_input_ids(self, language):
+        # Sama dengan forced_decoder_ids HF: SOT, bahasa, task, tanpa timestamp
+        return self.tokenizer.convert_tokens_to_ids(
+            [
+                "<|startoftranscript|>",
+                f"<|{language}|>",
+                "<|transcribe|>",
+                "<|notimestamps|>",
+            ]
+        )
+
+    def _encode(self, mel):
+        from tensorrt_llm._utils import str_dtype_to_trt, trt_dtype_to_torch
+        from tensorrt_llm.runtime import TensorInfo
+
+        input_lengths = torch.tensor(
+            [mel.shape[2] // 2] * mel.shape[0], dtype=torch.int32, device=mel.device
+        )
+        inputs = {"x": mel, "input_lengths": input_lengths}
+        output_info = self.encoder_session.infer_shapes(
+            [
+                TensorInfo("x", str_dtype_to_trt(self.dtype), mel.shape),
+                TensorInfo(
+                    "input_lengths", str_dtype_to_trt("int32"), input_lengths.shape
+                ),
+            ]
+        )
+        outputs = {
+            t.name: torch.empty(
+                tuple(t.shape), dtype=trt_dtype_to_torch(t.dtype), device="cuda"
+            )
+            for t in output_info
+        }
+        stream = torch.cuda.current_stream()
+        if not self.encoder_session.run(
+            inputs=inputs, outputs=outputs, stream=stream.cuda_stream
+        ):
+            raise RuntimeError("TensorRT encoder execution failed")
+        stream.synchronize()
+        return outputs["output"]
+
+    def _decode(self, decoder_input_ids, encoder_outputs, max_new_tokens=128):
+        from tensorrt_llm.runtime import SamplingConfig
+
+        batch_size, encoder_length = encoder_outputs.shape[:2]
+        encoder_input_lengths = torch.full(
+            (batch_size,), encoder_length, dtype=torch.int32, device="cuda"
+        )
+        decoder_input_lengths = torch.full(
+            (batch_size,), decoder_input_ids.shape[-1], dtype=torch.int32, device="cuda"
+        )
+        cross_attention_mask = torch.ones(
+            [batch_size, 1, encoder_length], dtype=torch.int32, device="cuda"
+        )
+
+        self.decoder_session.setup(
+            batch_size,
+            decoder_input_ids.shape[-1],
+            max_new_tokens,
+            beam_width=1,
+            encoder_max_input_length=encoder_length,
+        )
+        output_ids = self.decoder_session.decode(
+            decoder_input_ids,
+            decoder_input_lengths,
+            SamplingConfig(end_id=self.eot_id, pad_id=self.eot_id, num_beams=1),
+            encoder_output=encoder_outputs,
+            encoder_input_lengths=encoder_input_lengths,
+            cross_attention_mask=cross_attention_mask,
+        )
+        torch.cuda.synchronize()
+        return output_ids[:, 0, decoder_input_ids.shape[-1] :].cpu().tolist()
+
+    def transcribe(self, audio_file, language="id"):
+        try:
+            audio_input = load_audio(audio_file)
+
+            mel = self.processor(
                 audio_input, sampling_rate=16000, return_tensors="pt"
             ).input_features
+            mel = mel.to("cuda", dtype=getattr(torch, self.dtype))
 
-            input_features = input_features.to(self.device)
-            generated_ids = self.model.generate(
-                input_features,
-                forced_decoder_ids=self.processor.get_decoder_prompt_ids(
-                    language=language
-                ),
+            decoder_input_ids = torch.tensor(
+                [self._decoder_input_ids(language)], dtype=torch.int32, device="cuda"
             )
+            # transcribe dipanggil lewat asyncio.to_thread, jadi request paralel
+            # tidak boleh memakai GenerationSession yang sama bersamaan
+            with self._lock:
+                generated_ids = self._decode(decoder_input_ids, self._encode(mel))
 
-            transcription = self.processor.batch_decode(
+            transcription = self.tokenizer.batch_decode(
                 generated_ids, skip_special_tokens=True
             )[0]
-            return transcription
+            return transcription.strip()
 
         except Exception as e:
             raise HTTPException(
@@ -62,14 +512,22 @@ class OpenAIWhisperClient(TranscriptionClient):
     def __init__(self, api_key):
         self.client = OpenAI(api_key=api_key)
 
-    def transcribe(self, audio_file_path, language="id"):
+    def _create_transcription(self, audio_file, language):
+        return self.client.audio.transcriptions.create(
+            file=("audio.wav", audio_file, "audio/wav"),
+            model="whisper-1",
+            language=language,
+        )
+
+    def transcribe(self, audio_file, language="id"):
         try:
-            with open(audio_file_path, "rb") as audio_file:
-                transcription = self.client.audio.transcriptions.create(
-                    file=audio_file,
-                    model="whisper-1",
-                    language=language,
-                )
+            if isinstance(audio_file, (str, os.PathLike)):
+                with open(audio_file, "rb") as f:
+                    transcription = self._create_transcription(f, language)
+            else:
+                # File upload yang sudah di-spool dikirim apa adanya, httpx
+                # membacanya per chunk tanpa salinan bytes penuh
+                transcription = self._create_transcription(audio_file, language)
 
             if hasattr(transcription, "text"):
                 return transcription.text
@@ -85,51 +543,56 @@ class OpenAIWhisperClient(TranscriptionClient):
             )
 
 
-class OpenAIClient:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
-
-    def get_ai_response(self, question, position, interview_type="hr"):
-        try:
-            ai_response = rag_service.get_ai_response(
-                question, position, interview_type
-            )
-            return ai_response
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, detail=f"Error in AI response: {str(e)}"
-            )
-
-
 class AIService:
+    OPENAI_VOICE = "alloy"
+    ELEVENLABS_VOICE_ID = "3mAVBNEqop5UbHtD8oxQ"
+
     def __init__(
         self,
         transcription_client: TranscriptionClient,
         tts_service: str = "openai",
+        tts_cache_dir=None,
     ):
         self.transcription_client = transcription_client
+        self.batch_runner = (
+            BatchedWhisperRunner(transcription_client)
+            if isinstance(transcription_client, HuggingFaceWhisperClient)
+            else None
+        )
         self.tts_service = tts_service.lower()
-        self.openai_client = OpenAIClient(api_key=os.getenv("OPENAI_API_KEY"))
+        self.openai_client = openai_client
         self.elevenlabs_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+        self._eleven_voice_settings = VoiceSettings(
+            stability=0.1,
+            similarity_boost=0.3,
+            style=0.0,
+            use_speaker_boost=True,
+        )
+        # MP3 hasil TTS disimpan per hash (teks, suara) supaya kalimat yang
+        # sering berulang tidak perlu dikirim ulang ke layanan TTS
+        self.tts_cache_dir = Path(tts_cache_dir) if tts_cache_dir else None
+        if self.tts_cache_dir is not None:
+            self.tts_cache_dir.mkdir(parents=True, exist_ok=True)
 
     async def handle_audio_transcription(self, audio: UploadFile):
         if not audio:
             raise HTTPException(status_code=400, detail="No audio file provided")
 
         try:
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file_name = temp_file.name
-
-            audio_content = await audio.read()
-
-            with open(temp_file_name, "wb") as f:
-                f.write(audio_content)
-
-            transcription = self.transcription_client.transcribe(
-                temp_file_name, language="id"
-            )
-
-            os.remove(temp_file_name)
+            # UploadFile sudah di-spool oleh Starlette; file-nya dipakai langsung
+            # tanpa menyalin seluruh isi upload ke buffer baru
+            await audio.seek(0)
+            audio_file = audio.file
+
+            if self.batch_runner is not None:
+                audio_input = await asyncio.to_thread(load_audio, audio_file)
+                transcription = await self.batch_runner.submit(
+                    audio_input, language="id"
+                )
+            else:
+                transcription = await asyncio.to_thread(
+                    self.transcription_client.transcribe, audio_file, "id"
+                )
 
             if transcription:
                 return transcription
@@ -144,51 +607,335 @@ class AIService:
                 status_code=500, detail=f"Error in transcription: {str(e)}"
             )
 
-    def generate_speech(self, text: str, user_id: str, filename: str = None) -> str:
-        if filename is None:
-            filename = f"temp_audio_{user_id}_{uuid.uuid4()}.mp3"
+    async def get_ai_response(
+        self,
+        question,
+        session,
+        position,
+        interview_type=InterviewType.HR,
+        streaming=False,
+    ):
+        # Dengan streaming=True, pertanyaan dikembalikan sebagai async iterator token
+        try:
+            async with llm_semaphore:
+                ai_response = await get_rag_service().get_ai_response(
+                    question, session, position, interview_type, streaming
+                )
+            # Hasil evaluasi berupa dict, dijadikan teks sekali di sini
+            if isinstance(ai_response, dict):
+                ai_response = orjson.dumps(ai_response).decode()
+            elif not isinstance(ai_response, str):
+                ai_response = _hold_llm_slot(ai_response)
+            return ai_response
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error in AI response: {str(e)}"
+            )
 
-        if isinstance(text, dict):
-            text = json.dumps(text, ensure_ascii=False)
+    def _elevenlabs_chunks(self, text: str):
+        response = self.elevenlabs_client.text_to_speech.convert(
+            voice_id=self.ELEVENLABS_VOICE_ID,
+            output_format="mp3_22050_32",
+            text=text,
+            model_id="eleven_turbo_v2_5",
+            language_code="id",
+            voice_settings=self._eleven_voice_settings,
+        )
+        for chunk in response:
+            if chunk:
+                yield chunk
+
+    def _tts_cache_path(self, text: str):
+        if self.tts_cache_dir is None:
+            return None
+        voice = (
+            self.ELEVENLABS_VOICE_ID
+            if self.tts_service == "elevenlabs"
+            else self.OPENAI_VOICE
+        )
+        key = hashlib.sha256(f"{self.tts_service}:{voice}:{text}".encode()).hexdigest()
+        return self.tts_cache_dir / f"{key[:16]}.mp3"
+
+    @staticmethod
+    def _store_in_cache(source, cache_path):
+        # Hardlink kalau bisa, file sementara boleh dihapus tanpa mengganggu cache
+        try:
+            os.link(source, cache_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(source, cache_path)
+
+    @staticmethod
+    def _copy_from_cache(cache_path, filename):
+        try:
+            os.link(cache_path, filename)
+        except OSError:
+            shutil.copyfile(cache_path, filename)
+
+    def prune_tts_cache(self, max_age):
+        if self.tts_cache_dir is None:
+            return
+        cutoff = time.time() - max_age
+        with os.scandir(self.tts_cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    async def _synthesize(self, text: str) -> bytes:
+        cache_path = self._tts_cache_path(text)
+        if cache_path is not None:
+            try:
+                return await asyncio.to_thread(cache_path.read_bytes)
+            except FileNotFoundError:
+                pass
+
+        audio = await self._synthesize_uncached(text)
+        if cache_path is not None:
+            # Ditulis ke file sementara dulu supaya pembaca lain tidak melihat
+            # file yang setengah jadi
+            tmp_path = cache_path.with_name(
+                f"{cache_path.stem}.{secrets.token_hex(4)}.tmp"
+            )
+            await asyncio.to_thread(tmp_path.write_bytes, audio)
+            os.replace(tmp_path, cache_path)
+        return audio
 
+    async def _synthesize_uncached(self, text: str) -> bytes:
         if self.tts_service == "elevenlabs":
-            response = self.elevenlabs_client.text_to_speech.convert(
-                voice_id="3mAVBNEqop5UbHtD8oxQ",
-                output_format="mp3_22050_32",
-                text=text,
-                model_id="eleven_turbo_v2_5",
-                language_code="id",
-                voice_settings=VoiceSettings(
-                    stability=0.1,
-                    similarity_boost=0.3,
-                    style=0.0,
-                    use_speaker_boost=True,
-                ),
+            return await asyncio.to_thread(
+                lambda: b"".join(self._elevenlabs_chunks(text))
             )
 
-            audio_stream = BytesIO()
+        elif self.tts_service == "openai":
+            response = await self.openai_client.audio.speech.create(
+                model="tts-1",
+                voice=self.OPENAI_VOICE,
+                input=text,
+            )
+            return response.content
 
-            for chunk in response:
-                if chunk:
-                    audio_stream.write(chunk)
+        else:
+            raise ValueError(f"Unsupported TTS service: {self.tts_service}")
 
-            with open(filename, "wb") as audio_file:
-                audio_file.write(audio_stream.getvalue())
+    async def generate_speech(
+        self, text: str, user_id: str, filename: str = None
+    ) -> str:
+        if filename is None:
+            filename = f"temp_audio_{user_id}_{secrets.token_urlsafe(8)}.mp3"
 
+        cache_path = self._tts_cache_path(text)
+        if cache_path is not None and cache_path.exists():
+            await asyncio.to_thread(self._copy_from_cache, cache_path, filename)
             return filename
 
-        elif self.tts_service == "openai":
-            speech_file_path = Path(filename)
-
-            response = self.openai_client.client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=text,
-            )
+        if self.tts_service == "elevenlabs":
+            # Chunk ElevenLabs langsung ditulis ke file tanpa buffer penuh
+            def write_stream():
+                with open(filename, "wb") as audio_file:
+                    for chunk in self._elevenlabs_chunks(text):
+                        audio_file.write(chunk)
 
+            await asyncio.to_thread(write_stream)
+        else:
             # Simpan hasil speech ke file
-            response.stream_to_file(speech_file_path)
-            return str(speech_file_path)
+            audio = await self._synthesize_uncached(text)
+            await asyncio.to_thread(Path(filename).write_bytes, audio)
+
+        if cache_path is not None:
+            await asyncio.to_thread(self._store_in_cache, filename, cache_path)
+        return filename
+
+    async def stream_speech(self, tokens, on_token=None):
+        """Mengubah stream token LLM menjadi ``(kalimat, mp3)`` berurutan.
+
+        TTS setiap kalimat dimulai begitu kalimat itu selesai di-stream, jadi
+        beberapa kalimat di-synthesize paralel selagi LLM masih menjawab.
+        ``on_token`` dipanggil untuk setiap token mentah begitu token itu tiba.
+        """
+
+        queue = asyncio.Queue()
+
+        async def produce():
+            pending = ""
+            try:
+                async for token in tokens:
+                    if on_token is not None:
+                        on_token(token)
+                    *sentences, pending = SENTENCE_END.split(pending + token)
+                    for sentence in sentences:
+                        task = asyncio.create_task(self._synthesize(sentence))
+                        queue.put_nowait((sentence, task))
+                if pending.strip():
+                    task = asyncio.create_task(self._synthesize(pending))
+                    queue.put_nowait((pending, task))
+            finally:
+                queue.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (item := await queue.get()) is not None:
+                sentence, task = item
+                yield sentence, await task
+            await producer
+        finally:
+            producer.cancel()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    item[1].cancel()
+
+    async def generate_speech_streamed(self, tokens, filename: str):
+        """TTS per kalimat selagi LLM masih streaming.
+
+        Potongan MP3 ditulis berurutan ke ``filename``. Mengembalikan
+        ``(teks_lengkap, filename)``.
+        """
+
+        parts = []
+        try:
+            # Open & write dijalankan di thread supaya event loop tidak terblokir
+            audio_file = await asyncio.to_thread(open, filename, "wb")
+            try:
+                async for _, segment in self.stream_speech(tokens, parts.append):
+                    await asyncio.to_thread(audio_file.write, segment)
+            finally:
+                await asyncio.to_thread(audio_file.close)
+        except BaseException:
+            # File setengah jadi tidak akan pernah dijadwalkan untuk dihapus
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+
+        return "".join(parts), filename
+
+
+class QuizBatcher:
+    """Mengumpulkan prompt quiz yang datang bersamaan lalu mengirimnya sekaligus.
+
+    Prompt dikumpulkan maksimal ``max_wait`` detik atau ``max_batch_size``
+    item, dikelompokkan per panjang prompt (< 500 atau >= 500 karakter), lalu
+    setiap kelompok dikirim paralel lewat satu client OpenAI yang sama.
+    """
 
-        else:
-            raise ValueError(f"Unsupported TTS service: {self.tts_service}")
+    def __init__(
+        self,
+        client,
+        max_batch_size=16,
+        max_wait=0.05,
+        system_prompt=None,
+        **completion_kwargs,
+    ):
+        self.client = client
+        self.system_prompt = system_prompt
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.completion_kwargs = completion_kwargs
+        self._queue = None
+        self._worker = None
+        self._inflight = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, prompt):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def _complete(self, prompt):
+        messages = [{"role": "user", "content": prompt}]
+        if self.system_prompt:
+            messages.insert(0, {"role": "system", "content": self.system_prompt})
+
+        async with llm_semaphore:
+            response = await self.client.chat.completions.create(
+                messages=messages,
+                **self.completion_kwargs,
+            )
+        return response.choices[0].message.content.strip()
+
+    async def _dispatch(self, items):
+        results = await asyncio.gather(
+            *[self._complete(prompt) for prompt, _ in items], return_exceptions=True
+        )
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run(self):
+        while True:
+            buckets = {}
+            items = await collect_batch(self._queue, self.max_batch_size, self.max_wait)
+            for prompt, future in items:
+                buckets.setdefault(len(prompt) >= 500, []).append((prompt, future))
+
+            # Batch dikirim di background supaya batch berikutnya tetap terkumpul
+            for items in buckets.values():
+                task = asyncio.create_task(self._dispatch(items))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+
+class QuizBatchJobs:
+    """Generate quiz lewat OpenAI Batch API untuk quiz yang tidak perlu instan.
+
+    Biayanya sekitar setengah panggilan realtime dan tidak memakai rate limit
+    realtime, tapi hasilnya baru tersedia dalam 24 jam sehingga harus di-poll.
+    """
+
+    def __init__(self, client, **completion_kwargs):
+        self.client = client
+        self.completion_kwargs = completion_kwargs
+
+    async def submit(self, prompt, metadata=None):
+        request = {
+            "custom_id": uuid.uuid4().hex,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "messages": [{"role": "user", "content": prompt}],
+                **self.completion_kwargs,
+            },
+        }
+        input_file = await self.client.files.create(
+            file=("quiz.jsonl", orjson.dumps(request) + b"\n"), purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata=metadata,
+        )
+        return batch
+
+    async def poll(self, batch_id):
+        # Mengembalikan (status, metadata, isi jawaban); isi jawaban hanya ada
+        # jika status "completed"
+        batch = await self.client.batches.retrieve(batch_id)
+        metadata = batch.metadata or {}
+        if batch.status != "completed":
+            return batch.status, metadata, None
+
+        # Request yang gagal hanya muncul di error_file_id, batch-nya tetap
+        # "completed" tanpa output_file_id
+        if batch.output_file_id is None:
+            return "failed", metadata, None
+
+        output = await self.client.files.content(batch.output_file_id)
+        response = orjson.loads(output.content.splitlines()[0])["response"]
+        if response["status_code"] != 200:
+            return "failed", metadata, None
+        return (
+            "completed",
+            metadata,
+            response["body"]["choices"][0]["message"]["content"],
+        )
@@ -1,29 +1,45 @@
-import json
+import asyncio
 import logging
 import os
+import re
+import secrets
 import time
-import uuid
+import weakref
 from pathlib import Path
 from typing import Optional
 
-from ai import AIService, HuggingFaceWhisperClient, OpenAIWhisperClient
+import anyio
+import orjson
+from ai import (
+    AIService,
+    FasterWhisperClient,
+    HuggingFaceWhisperClient,
+    OpenAIWhisperClient,
+    ORTWhisperClient,
+    QuizBatcher,
+    QuizBatchJobs,
+    TRTWhisperClient,
+    http_client,
+    llm_semaphore,
+    openai_client,
+)
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi import FastAPI, File, Header, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from llama_index.llms.openai import OpenAI
-from openai import OpenAI
 from pydantic import BaseModel
-from rag_service import rag_service
+from rag_service import QUIZ_RESPONSE_FORMAT, InterviewType, get_rag_service
+from session_store import InMemorySessionStore, RedisSessionStore, new_session
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-audios_dir = Path("./audios")
-audios_dir.mkdir(parents=True, exist_ok=True)
+# Bisa diarahkan ke tmpfs (mis. /dev/shm/mirai-audios), file hanya hidup 5 menit
+AUDIOS_DIR = Path(os.getenv("AUDIOS_DIR", "./audios")).resolve()
+AUDIOS_DIR.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 welcoming_dir = Path(__file__).parent / "audios" / "welcoming"
 
@@ -34,21 +50,90 @@ app.mount(
     "/static/welcoming", StaticFiles(directory=welcoming_dir), name="static_welcoming"
 )
 
-sessions = {}
 SESSION_EXPIRY = 3600  # 1 hour session expiry time
+MAX_SESSIONS = 10_000
+AUDIO_EXPIRY = 300  # file audio dihapus 5 menit setelah dibuat
+CLEANUP_INTERVAL = 60
+AUDIO_CHUNK_SIZE = 64 * 1024
+# Nama file audio yang boleh diminta lewat /audio, tanpa "/" atau ".."
+AUDIO_FILENAME = re.compile(r"temp_audio_[A-Za-z0-9_-]+\.mp3")
+UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+TTS_CACHE_DIR = AUDIOS_DIR / "cache"
+TTS_CACHE_EXPIRY = 24 * 3600  # cache TTS disimpan 24 jam sejak dibuat
+TTS_CACHE_PRUNE_INTERVAL = 3600
+
+# Dengan REDIS_URL session dibagi antar worker, tanpa itu disimpan per proses
+redis_url = os.getenv("REDIS_URL")
+if redis_url:
+    sessions = RedisSessionStore(redis_url, SESSION_EXPIRY)
+else:
+    sessions = InMemorySessionStore(SESSION_EXPIRY, MAX_SESSIONS)
+
+# Satu giliran wawancara per user pada satu waktu (per proses), supaya dua
+# request dari user yang sama tidak saling menimpa riwayat di session
+user_locks = weakref.WeakValueDictionary()
+
+
+def _user_lock(user_id):
+    lock = user_locks.get(user_id)
+    if lock is None:
+        lock = user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+async def _get_or_create_session(user_id):
+    session = await sessions.get(user_id)
+    if session is None:
+        session = new_session()
+        await sessions.save(user_id, session)
+        logger.info(f"Created new session for user_id={user_id}")
+    else:
+        logger.info(f"Using existing session for user_id={user_id}")
+    return session
+
+
+# Antrian (expiry_ts, path) untuk file audio yang menunggu dihapus
+pending_deletions = asyncio.PriorityQueue()
+
 
+async def _delete_expired_files():
+    # AUDIO_EXPIRY selalu sama, jadi item di kepala antrian selalu yang
+    # paling dulu kedaluwarsa
+    while True:
+        expiry_ts, path = await pending_deletions.get()
+        delay = expiry_ts - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            os.remove(path)
+            logger.info(f"Deleted temporary file: {path}")
+        except Exception as e:
+            logger.error(f"Error deleting temporary file: {str(e)}")
 
-def cleanup_expired_sessions():
-    current_time = time.time()
-    expired_sessions = [
-        userid
-        for userid, session in sessions.items()
-        if current_time - session["timestamp"] > SESSION_EXPIRY
-    ]
 
-    for userid in expired_sessions:
-        del sessions[userid]
-        logger.info(f"Session for userid {userid} expired and was removed.")
+def _new_audio_prefix(user_id):
+    # user_id disanitasi supaya nama file selalu cocok dengan AUDIO_FILENAME
+    safe_user_id = UNSAFE_FILENAME_CHARS.sub("_", user_id)
+    return f"temp_audio_{safe_user_id}_{secrets.token_urlsafe(8)}"
+
+
+async def _periodic_cleanup(interval):
+    # GC session jalan di sini, tidak pernah di jalur request
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sessions.cleanup_expired()
+        except Exception as e:
+            logger.error(f"Error in periodic cleanup: {str(e)}")
+
+
+async def _periodic_tts_cache_prune(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(ai_service.prune_tts_cache, TTS_CACHE_EXPIRY)
+        except Exception as e:
+            logger.error(f"Error pruning TTS cache: {str(e)}")
 
 
 api_key = os.getenv("OPENAI_API_KEY")
@@ -58,17 +143,46 @@ if not api_key:
     )
 
 transcription_service = os.getenv("TRANSCRIPTION_SERVICE", "huggingface").lower()
-
-if transcription_service == "huggingface":
-    transcription_client = HuggingFaceWhisperClient()
-elif transcription_service == "openai":
-    transcription_client = OpenAIWhisperClient(api_key=api_key)
-else:
+if transcription_service not in (
+    "huggingface",
+    "openai",
+    "trt",
+    "onnx",
+    "faster-whisper",
+):
     raise ValueError(
-        f"Invalid TRANSCRIPTION_SERVICE '{transcription_service}'. Must be 'huggingface' or 'openai'."
+        f"Invalid TRANSCRIPTION_SERVICE '{transcription_service}'. Must be 'huggingface', 'openai', 'trt', 'onnx' or 'faster-whisper'."
     )
 
-ai_service = AIService(transcription_client=transcription_client)
+
+def _create_transcription_client():
+    if transcription_service == "huggingface":
+        return HuggingFaceWhisperClient()
+    if transcription_service == "openai":
+        return OpenAIWhisperClient(api_key=api_key)
+    if transcription_service == "trt":
+        return TRTWhisperClient()
+    if transcription_service == "onnx":
+        return ORTWhisperClient()
+    return FasterWhisperClient()
+
+
+# Dibuat di startup hook, bukan saat import: dengan WEB_CONCURRENCY > 1 modul
+# ini juga diimport oleh proses supervisor yang tidak melayani request, jadi
+# model Whisper hanya dimuat di proses worker
+ai_service = None
+# JSON mode: OpenAI menjamin output berupa objek JSON yang valid
+quiz_batcher = QuizBatcher(
+    openai_client,
+    system_prompt="Return JSON only",
+    model="gpt-4o-mini",
+    response_format={"type": "json_object"},
+    temperature=0.7,
+    max_tokens=300,
+)
+quiz_jobs = QuizBatchJobs(
+    openai_client, model="gpt-4o-mini", response_format=QUIZ_RESPONSE_FORMAT
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -82,20 +196,84 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@app.on_event("startup")
+async def start_cleanup_task():
+    global ai_service
+    transcription_client = await asyncio.to_thread(_create_transcription_client)
+    ai_service = AIService(
+        transcription_client=transcription_client, tts_cache_dir=TTS_CACHE_DIR
+    )
+    # Index dimuat/dibangun di thread supaya tidak memblokir event loop
+    await asyncio.to_thread(get_rag_service)
+    app.state.cleanup_task = asyncio.create_task(_periodic_cleanup(CLEANUP_INTERVAL))
+    app.state.deletion_task = asyncio.create_task(_delete_expired_files())
+    app.state.tts_cache_task = asyncio.create_task(
+        _periodic_tts_cache_prune(TTS_CACHE_PRUNE_INTERVAL)
+    )
+    quiz_batcher.start()
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    app.state.cleanup_task.cancel()
+    app.state.deletion_task.cancel()
+    app.state.tts_cache_task.cancel()
+    await http_client.aclose()
+
+
 @app.get("/generate_quiz")
 async def generate_quiz(
     position: str = Query(
         ..., description="The position for which the quiz will be generated"
     ),
+    mode: str = Query(
+        "instant",
+        description="'instant' or 'batch' (OpenAI Batch API, poll /generate_quiz/{batch_id})",
+    ),
 ):
+    if mode not in ("instant", "batch"):
+        raise HTTPException(status_code=400, detail="mode must be 'instant' or 'batch'")
+
     try:
-        quiz_json = rag_service.generate_quiz(position)
-        return JSONResponse(content=quiz_json)
+        if mode == "batch":
+            cached = get_rag_service().cached_quiz(position)
+            if cached is not None:
+                return ORJSONResponse(content={"status": "completed", **cached})
+
+            quiz_prompt = await get_rag_service().quiz_batch_prompt(position)
+            batch = await quiz_jobs.submit(quiz_prompt, metadata={"position": position})
+            return ORJSONResponse(
+                content={"status": batch.status, "batch_id": batch.id}
+            )
+
+        async with llm_semaphore:
+            quiz_json = await get_rag_service().generate_quiz(position)
+        return ORJSONResponse(content=quiz_json)
     except Exception as e:
         logger.error(f"Error in /generate_quiz endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@app.get("/generate_quiz/{batch_id}")
+async def poll_quiz(batch_id: str):
+    try:
+        status, metadata, response_text = await quiz_jobs.poll(batch_id)
+        if response_text is None:
+            # Status "failed" berarti quiz harus diminta ulang
+            return ORJSONResponse(content={"status": status, "batch_id": batch_id})
+
+        quiz_json = orjson.loads(response_text)
+        position = metadata.get("position")
+        if position is not None:
+            await get_rag_service().cache_quiz(position, quiz_json)
+        return ORJSONResponse(content={"status": status, **quiz_json})
+    except Exception as e:
+        logger.error(
+            f"Error in /generate_quiz/{batch_id} endpoint: {str(e)}", exc_info=True
+        )
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
 @app.post("/speak")
 async def speak(
     audio: UploadFile = File(...),
@@ -105,83 +283,242 @@ async def speak(
         "tech", description="Type of interview: 'hr' or 'tech'"
     ),
 ):
-    cleanup_expired_sessions()
-
-    if user_id not in sessions:
-        sessions[user_id] = {
-            "conversation_history": [],
-            "current_question_index": 0,
-            "timestamp": time.time(),
-            "file_names": [],
-        }
-        logger.info(f"Created new session for user_id={user_id}")
-    else:
-        logger.info(f"Using existing session for user_id={user_id}")
-
-    session = sessions[user_id]
+    position = position.strip()
+    interview_type = InterviewType.parse(interview_type)
 
+    filename = None
     speech_file_path = None
     try:
         transcription = await ai_service.handle_audio_transcription(audio)
         logger.info(f"Transcription: {transcription}")
 
-        ai_response = ai_service.openai_client.get_ai_response(
-            transcription, position, interview_type
-        )
-        logger.info(f"AI Response: {ai_response}")
+        async with _user_lock(user_id):
+            session = await _get_or_create_session(user_id)
 
-        filename = f"audios/temp_audio_{user_id}_{uuid.uuid4()}.mp3"
-        speech_file_path = ai_service.generate_speech(
-            ai_response, user_id=user_id, filename=filename
-        )
+            ai_response = await ai_service.get_ai_response(
+                transcription, session, position, interview_type, streaming=True
+            )
 
-        sessions[user_id]["file_names"].append(Path(speech_file_path).name)
-        session["conversation_history"].append(f"Kandidat: {transcription}")
-        session["conversation_history"].append(f"HR: {ai_response}")
-        session["current_question_index"] += 1
-        session["timestamp"] = time.time()
+            filename = os.path.join(AUDIOS_DIR, f"{_new_audio_prefix(user_id)}.mp3")
+            if isinstance(ai_response, str):
+                speech_file_path = await ai_service.generate_speech(
+                    ai_response, user_id, filename
+                )
+            else:
+                # Pertanyaan di-stream: TTS jalan per kalimat selagi LLM menjawab
+                streamed = ai_service.generate_speech_streamed(ai_response, filename)
+                ai_response, speech_file_path = await streamed
+            logger.info(f"AI Response: {ai_response}")
+
+            await sessions.save(user_id, session)
+        name = os.path.basename(speech_file_path)
+        await sessions.add_file(user_id, name)
 
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "transcription": transcription,
                 "ai_response": ai_response,
-                "audio_url": f"/audio/{Path(speech_file_path).name}?user_id={user_id}",
+                "audio_url": f"/audio/{name}?user_id={user_id}",
             }
         )
 
     except Exception as e:
+        # MP3 setengah jadi dari TTS yang gagal tidak pernah masuk antrian hapus
+        if speech_file_path is None and filename and os.path.exists(filename):
+            os.remove(filename)
         logger.error(f"Error in /speak endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
     finally:
         if speech_file_path:
-            import threading
+            pending_deletions.put_nowait((time.time() + AUDIO_EXPIRY, speech_file_path))
+
+
+@app.post("/speak_stream")
+async def speak_stream(
+    audio: UploadFile = File(...),
+    position: str = Query(..., description="The position for the interview"),
+    user_id: str = Query(..., description="User identifier"),
+    interview_type: str = Query(
+        "tech", description="Type of interview: 'hr' or 'tech'"
+    ),
+):
+    """
+    Sama seperti /speak, tapi hasilnya NDJSON: baris {"token"} begitu token
+    LLM tiba, baris {"text", "audio_url"} begitu TTS satu kalimat selesai,
+    lalu satu baris penutup.
+    """
+    position = position.strip()
+    interview_type = InterviewType.parse(interview_type)
+
+    try:
+        transcription = await ai_service.handle_audio_transcription(audio)
+        logger.info(f"Transcription: {transcription}")
+    except Exception as e:
+        logger.error(f"Error in /speak_stream endpoint: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-            def delete_file(path, delay):
-                time.sleep(delay)
+    # Token mentah dari LLM, untuk teks lengkap di baris penutup
+    parts = []
+    # Baris NDJSON (token LLM dan audio per kalimat) sesuai urutan tibanya
+    events = asyncio.Queue()
+
+    def on_token(token):
+        parts.append(token)
+        events.put_nowait({"token": token})
+
+    async def publish(text, speech_file_path):
+        name = os.path.basename(speech_file_path)
+        pending_deletions.put_nowait((time.time() + AUDIO_EXPIRY, speech_file_path))
+        await sessions.add_file(user_id, name)
+        events.put_nowait(
+            {"text": text, "audio_url": f"/audio/{name}?user_id={user_id}"}
+        )
+
+    async def produce(session):
+        try:
+            ai_response = await ai_service.get_ai_response(
+                transcription, session, position, interview_type, streaming=True
+            )
+            if isinstance(ai_response, str):
+                # Hasil evaluasi sudah lengkap, cukup satu potongan audio
+                parts.append(ai_response)
+                filename = os.path.join(AUDIOS_DIR, f"{_new_audio_prefix(user_id)}.mp3")
+                await publish(
+                    ai_response,
+                    await ai_service.generate_speech(ai_response, user_id, filename),
+                )
+                return
+
+            prefix = _new_audio_prefix(user_id)
+            index = 0
+            async for sentence, segment in ai_service.stream_speech(
+                ai_response, on_token
+            ):
+                filename = os.path.join(AUDIOS_DIR, f"{prefix}_{index}.mp3")
+                await asyncio.to_thread(Path(filename).write_bytes, segment)
+                index += 1
+                await publish(sentence, filename)
+        finally:
+            events.put_nowait(None)
+
+    async def body():
+        try:
+            # Lock diambil di dalam generator supaya selalu dilepas saat
+            # stream selesai atau client memutus koneksi
+            async with _user_lock(user_id):
+                session = await _get_or_create_session(user_id)
+                producer = asyncio.create_task(produce(session))
                 try:
-                    os.remove(path)
-                    logger.info(f"Deleted temporary file: {path}")
-                except Exception as e:
-                    logger.error(f"Error deleting temporary file: {str(e)}")
+                    while (event := await events.get()) is not None:
+                        yield orjson.dumps(event) + b"\n"
+                    await producer
+                finally:
+                    producer.cancel()
+
+                full_response = "".join(parts)
+                logger.info(f"AI Response: {full_response}")
+
+                # Riwayat sudah dicatat ke session oleh RAGService
+                await sessions.save(user_id, session)
+
+            yield orjson.dumps(
+                {
+                    "transcription": transcription,
+                    "ai_response": full_response,
+                    "done": True,
+                }
+            ) + b"\n"
+        except Exception as e:
+            # Header sudah terkirim, jadi error dilaporkan sebagai baris terakhir
+            logger.error(f"Error in /speak_stream endpoint: {str(e)}", exc_info=True)
+            yield orjson.dumps({"error": f"Internal server error: {str(e)}"}) + b"\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def _parse_range(range_header, size):
+    # Hanya satu range yang didukung: "bytes=a-b", "bytes=a-" atau "bytes=-n"
+    unit, _, spec = range_header.partition("=")
+    start, sep, end = spec.strip().partition("-")
+    try:
+        if unit.strip() != "bytes" or not sep or "," in spec:
+            raise ValueError
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            start = max(size - int(end), 0)
+            end = size - 1
+        if start > end:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
 
-            threading.Thread(target=delete_file, args=(speech_file_path, 300)).start()
+async def _iter_file(path, start, length):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(AUDIO_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
 
 
 @app.get("/audio/{filename}")
-async def get_audio(filename: str, user_id: str = Query(...)):
+async def get_audio(
+    filename: str,
+    user_id: str = Query(...),
+    range_header: Optional[str] = Header(None, alias="Range"),
+):
     logger.info(f"Request to get audio: filename={filename}, user_id={user_id}")
-    if user_id in sessions:
+    if not AUDIO_FILENAME.fullmatch(filename):
+        logger.error(f"Invalid audio filename: {filename}")
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if await sessions.exists(user_id):
         logger.info(f"Session found for user_id={user_id}")
-        if filename in sessions[user_id]["file_names"]:
+        if await sessions.has_file(user_id, filename):
             logger.info(f"Filename {filename} found in session for user_id={user_id}")
-            file_path = Path(f"./audios/{filename}")
-            if file_path.exists():
-                logger.info(f"File {filename} exists, returning file.")
-                return FileResponse(file_path, media_type="audio/mpeg")
-            else:
+            file_path = os.path.join(AUDIOS_DIR, filename)
+            try:
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
                 logger.error(f"File {filename} does not exist on disk.")
                 raise HTTPException(status_code=404, detail="File not found")
+
+            logger.info(f"File {filename} exists, returning file.")
+            headers = {
+                "Accept-Ranges": "bytes",
+                "Cache-Control": f"private, max-age={AUDIO_EXPIRY}",
+            }
+            if range_header:
+                # Range request (seek di player) dilayani potongannya saja
+                size = stat_result.st_size
+                start, end = _parse_range(range_header, size)
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+                headers["Content-Length"] = str(end - start + 1)
+                return StreamingResponse(
+                    _iter_file(file_path, start, end - start + 1),
+                    status_code=206,
+                    media_type="audio/mpeg",
+                    headers=headers,
+                )
+
+            # stat_result juga dipakai Starlette untuk ETag/Last-Modified
+            return FileResponse(
+                file_path,
+                media_type="audio/mpeg",
+                stat_result=stat_result,
+                headers=headers,
+            )
         else:
             logger.error(
                 f"Filename {filename} not found in session for user_id={user_id}"
@@ -200,6 +537,17 @@ async def get_config():
 ######################## JobSeeker Advice ########################
 from fastapi import Body, Query
 
+ADVICE_PROMPT = """
+TOLONG SELALU JAWAB DENGAN BAHASA INDONESIA.
+
+Anda adalah seorang penasihat karir advance yang membantu pencari kerja yang ingin menjadi seorang {job_title} handal.
+Berdasarkan tren industri saat ini, keterampilan utama yang dibutuhkan untuk posisi ini adalah: {skills}.
+
+Mohon berikan advice/saran untuk mendapatkan pekerjaan impian nya sesuai dengan job {job_title}
+
+Buat dalam 2 kalimat saja
+"""
+
 
 @app.post("/jobseeker_advice")
 async def jobseeker_advice(
@@ -213,42 +561,37 @@ async def jobseeker_advice(
     try:
         logger.info(f"Received JSON data: {data}")
 
-        if "wordcloud_data" not in data:
+        wordcloud_data = data.get("wordcloud_data")
+        if not isinstance(wordcloud_data, dict):
             logger.error(f"Invalid JSON structure: {data}")
             raise HTTPException(
                 status_code=400,
                 detail="Invalid JSON structure, 'wordcloud_data' missing",
             )
 
-        wordcloud_data = data.get("wordcloud_data", {})
         logger.info(f"Extracted wordcloud data: {wordcloud_data}")
 
-        advice_prompt = f"""
-        TOLONG SELALU JAWAB DENGAN BAHASA INDONESIA.
-
-        Anda adalah seorang penasihat karir advance yang membantu pencari kerja yang ingin menjadi seorang {job_title} handal.
-        Berdasarkan tren industri saat ini, keterampilan utama yang dibutuhkan untuk posisi ini adalah: {', '.join(wordcloud_data.keys())}.
-
-        Mohon berikan advice/saran untuk mendapatkan pekerjaan impian nya sesuai dengan job {job_title}
-
-        Buat dalam 2 kalimat saja
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": advice_prompt}],
-            temperature=0.7,
+        advice_prompt = ADVICE_PROMPT.format(
+            job_title=job_title, skills=", ".join(wordcloud_data.keys())
         )
 
-        response_text = response.choices[0].message.content.strip()
+        async with llm_semaphore:
+            response = await openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": advice_prompt}],
+                temperature=0.7,
+                # Jawaban diminta 2 kalimat, panjang output dibatasi
+                max_tokens=200,
+            )
+
+        response_text = (response.choices[0].message.content or "").strip()
 
         logger.info(f"AI Response: {response_text}")
 
-        return JSONResponse(content={"advice": response_text})
+        return ORJSONResponse(content={"advice": response_text})
 
-    except json.JSONDecodeError:
-        logger.error("Failed to parse JSON data")
-        raise HTTPException(status_code=400, detail="Failed to parse JSON data")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating jobseeker advice: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -257,14 +600,28 @@ async def jobseeker_advice(
 ######################## Quiz Roadmap ########################
 
 
+ROADMAP_QUIZ_PROMPT = """
+TOLONG SELALU JAWAB DENGAN BAHASA INDONESIA
+
+You are a domain expert creating a quiz for the topic "{title}".
+Description: {description}
+
+Tolong buat 1 pertanyaan yang relevan dengan description tersebut. Include 4 multiple-choice options tanpa keterangan A B C D and indicate the correct answer index.
+
+Format the output in JSON with the following structure:
+{{
+  "question": "Your generated question",
+  "choices": ["Option 1", "Option 2", "Option 3", "Option 4"],
+  "answer": CorrectAnswerIndex
+}}
+"""
+
+
 class QuizRequest(BaseModel):
     title: str
     description: Optional[str] = None
 
 
-client = OpenAI(api_key=api_key)
-
-
 @app.post("/roadmap_quiz")
 async def roadmap_quiz(request: QuizRequest):
     """
@@ -276,38 +633,14 @@ async def roadmap_quiz(request: QuizRequest):
             request.description if request.description else "Deskripsi tidak tersedia"
         )
 
-        quiz_prompt = f"""
-        TOLONG SELALU JAWAB DENGAN BAHASA INDONESIA
+        quiz_prompt = ROADMAP_QUIZ_PROMPT.format(title=title, description=description)
 
-        You are a domain expert creating a quiz for the topic "{title}".
-        Description: {description}
+        response_text = await quiz_batcher.submit(quiz_prompt)
+        quiz_json = orjson.loads(response_text)
 
-        Tolong buat 1 pertanyaan yang relevan dengan description tersebut. Include 4 multiple-choice options tanpa keterangan A B C D and indicate the correct answer index.
-
-        Format the output in JSON with the following structure:
-        {{
-          "question": "Your generated question",
-          "choices": ["Option 1", "Option 2", "Option 3", "Option 4"],
-          "answer": CorrectAnswerIndex
-        }}
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": quiz_prompt}],
-            temperature=0.7,
-            max_tokens=300,
-        )
+        return ORJSONResponse(content=quiz_json)
 
-        response_text = response.choices[0].message.content.strip()
-
-        start_index = response_text.find("{")
-        end_index = response_text.rfind("}") + 1
-        quiz_json = json.loads(response_text[start_index:end_index])
-
-        return JSONResponse(content=quiz_json)
-
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("Failed to parse JSON from OpenAI response")
         raise HTTPException(status_code=400, detail="Failed to parse JSON response")
     except Exception as e:
@@ -318,4 +651,19 @@ async def roadmap_quiz(request: QuizRequest):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="debug")
+    # Worker > 1 butuh import string dan session bersama di Redis
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not redis_url:
+        raise ValueError(
+            "WEB_CONCURRENCY > 1 requires REDIS_URL so sessions are shared between workers."
+        )
+
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="127.0.0.1",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        log_level="debug",
+    )
@@ -1,6 +1,14 @@
-import json
+import asyncio
+import fcntl
+import functools
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
 
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 from llama_index.core import (
     Settings,
@@ -9,11 +17,367 @@ from llama_index.core import (
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.schema import MetadataMode
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
+from pydantic import BaseModel, ConfigDict
 
 load_dotenv()
 
+# text-embedding-3-small dipotong ke 512 dimensi (parameter `dimensions`),
+# 3x lebih kecil dari 1536 dengan penurunan kualitas yang minim
+EMBED_DIM = 512
+# Model embedding lokal untuk EMBED_BACKEND=huggingface/tei
+LOCAL_EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Jumlah respons LLM (quiz & pertanyaan pembuka) yang disimpan di cache
+RESPONSE_CACHE_SIZE = 256
+INSERT_BATCH_SIZE = 2048
+# Request embedding yang berjalan bersamaan saat membangun index
+EMBED_CONCURRENCY = 4
+# Giliran terakhir (Kandidat + HR) yang dikirim saat mengajukan pertanyaan
+HISTORY_WINDOW = 3
+
+# Prefix baris riwayat percakapan
+CANDIDATE_PREFIX = "Kandidat: "
+HR_PREFIX = "HR: "
+
+# System prompt statis dan ditaruh paling depan supaya prefix-nya identik di
+# semua panggilan (prompt caching OpenAI); posisi hanya ditambahkan di akhir
+HR_SYSTEM_PROMPT = """
+Nama anda adalah Mirai, seorang profesional HR yang berpengalaman dan sedang melakukan wawancara untuk posisi yang tertulis di akhir pesan ini.
+
+Sebelumnya, Anda sudah melakukan opening dengan statement sebagai berikut "Terima kasih karena telah mempunyai ketertarikan pada perusahaan kami, Nama saya Mirai dari tim rekrutmen. Terima kasih sudah meluangkan waktu untuk mengikuti sesi wawancara ini. Kami sangat senang bisa mengenal Anda lebih dekat hari ini. Semoga kita bisa melalui sesi ini dengan lancar dan nyaman. Jika ada hal yang ingin ditanyakan selama wawancara, jangan ragu untuk mengatakannya. Mari kita mulai dengan perkenalan diri anda secara kreatif"
+Jadi, tolong lanjutkan sesuai dengan konteks dan hasil dari jawaban kandidat sebagai "PERTANYAAN KEDUA"
+
+Ikuti panduan berikut:
+1. Berikan respons singkat dan relevan terhadap jawaban kandidat.
+2. Ajukan satu pertanyaan pada satu waktu, yang relevan dengan posisi tersebut.
+3. Pastikan untuk mencakup pertanyaan tentang:
+- Motivasi kandidat
+- Technical skills yang relevan dengan posisi tersebut
+- Pengalaman proyek yang relevan dengan posisi tersebut
+- Kemampuan pemecahan masalah
+- Kecocokan budaya kerja
+4. Gunakan konteks dari jawaban sebelumnya untuk membuat pertanyaan yang relevan.
+5. Pertahankan nada profesional sepanjang wawancara.
+6. Setelah 5 pertanyaan, berikan evaluasi yang sejujur-jujurnya mengenai jawaban kandidat, apakah sudah sesuai dengan STAR method, dan apakah kandidat sesuai dengan posisi tersebut.
+""".strip()
+
+TECH_SYSTEM_PROMPT = """
+Nama anda adalah Mirai, Anda adalah seorang User pada suatu perusahaan yang sedang melakukan wawancara teknis yang sedang melakukan wawancara untuk posisi yang tertulis di akhir pesan ini.
+
+Sebelumnya, Anda sudah melakukan opening dengan statement sebagai berikut "Terima kasih karena telah mempunyai ketertarikan pada perusahaan kami, Nama saya Mirai dari tim rekrutmen. Terima kasih sudah meluangkan waktu untuk mengikuti sesi wawancara ini. Kami sangat senang bisa mengenal Anda lebih dekat hari ini. Semoga kita bisa melalui sesi ini dengan lancar dan nyaman. Jika ada hal yang ingin ditanyakan selama wawancara, jangan ragu untuk mengatakannya. Mari kita mulai dengan perkenalan diri anda secara kreatif"
+Jadi, tolong lanjutkan sesuai dengan konteks dan hasil dari jawaban kandidat sebagai "PERTANYAAN KEDUA"
+
+Ajukan 3 pertanyaan teknis terkait posisi ini. Berikut adalah contoh pertanyaan yang bisa Anda ajukan untuk beberapa posisi:
+- Software Engineer: Gimana cara anda melakukan caching, bagaimana cara anda untuk melakukan API versioning.
+- Data Engineer: Bagaimana Anda melakukan data modeling, strategi pipeline data.
+
+Ikuti panduan berikut:
+1. Berikan respons singkat terhadap jawaban kandidat.
+2. Ajukan pertanyaan yang relevan satu per satu sesuai dengan konteks dari jawaban sebelumnya.
+3. Setelah 3 pertanyaan, lakukan evaluasi kandidat berdasarkan jawaban mereka.
+
+Pertahankan nada profesional sepanjang wawancara.
+""".strip()
+
+OPENING_INSTRUCTION = "Berikan sambutan singkat dan ajukan pertanyaan pertama yang relevan untuk posisi tersebut."
+NEXT_QUESTION_INSTRUCTION = "Berikan respons singkat dan ajukan pertanyaan berikutnya yang relevan untuk posisi tersebut."
+
+HR_EVALUATION_PROMPT = """
+Anda telah melakukan wawancara dengan kandidat untuk posisi {position}. Berdasarkan jawaban-jawaban kandidat berikut:
+
+{conversation_history}
+
+Berikan penilaian dalam bentuk angka 1-10 untuk masing-masing aspek berikut ini:
+1. Motivasi kandidat
+2. Technical skills yang relevan dengan posisi {position}
+3. Pengalaman proyek yang relevan dengan posisi {position}
+4. Kemampuan pemecahan masalah
+5. Kecocokan budaya kerja
+
+Jangan terlalu baik dalam memberikan skor jika memang dia belum kompeten/baru belajar, karena ini untuk pekerja professional. Selain memberikan skor, buatlah evaluasi singkat dalam bentuk teks untuk masing-masing aspek di atas. Evaluasi harus mencakup hal-hal positif serta area yang dapat ditingkatkan, dan berikan saran yang membantu kandidat dalam pengembangan lebih lanjut.
+
+Format output yang diinginkan:
+{{
+    "motivasi": nilai_1_sampai_10,
+    "technical_skills": nilai_1_sampai_10,
+    "pengalaman_proyek": nilai_1_sampai_10,
+    "pemecahan_masalah": nilai_1_sampai_10,
+    "kecocokan_budaya": nilai_1_sampai_10,
+    "evaluasi_teks": "Evaluasi & saran untuk kandidat ke depan."
+}}
+"""
+
+TECH_EVALUATION_PROMPT = """
+Anda telah melakukan wawancara teknis dengan kandidat untuk posisi {position}. Berdasarkan jawaban-jawaban kandidat berikut:
+
+{conversation_history}
+
+Berikan penilaian dalam bentuk angka 1-10 untuk masing-masing aspek berikut ini:
+1. Technical skills yang relevan dengan posisi {position}
+2. Pengalaman proyek yang relevan dengan posisi {position}
+3. Kemampuan pemecahan masalah
+
+Jangan terlalu baik dalam memberikan skor jika memang dia belum kompeten/baru belajar, karena ini untuk pekerja professional. Selain memberikan skor, buatlah evaluasi singkat dalam bentuk teks untuk masing-masing aspek di atas. Evaluasi harus mencakup hal-hal positif serta area yang dapat ditingkatkan, dan berikan saran yang membantu kandidat dalam pengembangan lebih lanjut.
+
+Format output yang diinginkan:
+{{
+    "technical_skills": nilai_1_sampai_10,
+    "pengalaman_proyek": nilai_1_sampai_10,
+    "pemecahan_masalah": nilai_1_sampai_10,
+    "evaluasi_teks": "Evaluasi & saran untuk kandidat ke depan."
+}}
+"""
+
+
+class InterviewType(IntEnum):
+    """Tipe wawancara; nilainya dipakai sebagai indeks tuple per tipe di bawah."""
+
+    HR = 0
+    TECH = 1
+
+    @classmethod
+    def parse(cls, value):
+        # Selain "hr" diperlakukan sebagai wawancara teknis
+        return cls.HR if value.strip().lower() == "hr" else cls.TECH
+
+
+# Diindeks dengan InterviewType
+SYSTEM_PROMPTS = (HR_SYSTEM_PROMPT, TECH_SYSTEM_PROMPT)
+EVALUATION_PROMPTS = (HR_EVALUATION_PROMPT, TECH_EVALUATION_PROMPT)
+QUESTION_LIMITS = (5, 3)
+
+QUIZ_PROMPT = """
+Anda adalah seorang profesional di bidang {position} yang sedang merancang 10 pertanyaan quiz teknikal untuk posisi {position}.
+Pertanyaan-pertanyaan ini harus relevan dengan keterampilan teknis yang dibutuhkan untuk posisi ini, mencakup berbagai aspek teknis terkait.
+
+Format hasil yang diinginkan adalah JSON dengan struktur berikut:
+
+```json
+{{
+  "quiz": [
+    {{
+      "question": "Pertanyaan 1",
+      "options": ["Opsi A", "Opsi B", "Opsi C", "Opsi D"],
+      "answer": "Jawaban yang benar"
+    }},
+    ...
+  ]
+}}
+```
+
+Harap buat 10 pertanyaan dengan format yang disebutkan di atas.
+"""
+
+
+class QuizItem(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    question: str
+    options: list[str]
+    answer: str
+
+
+class QuizSchema(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    quiz: list[QuizItem]
+
+
+class HrEvaluation(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    motivasi: int
+    technical_skills: int
+    pengalaman_proyek: int
+    pemecahan_masalah: int
+    kecocokan_budaya: int
+    evaluasi_teks: str
+
+
+class TechEvaluation(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    technical_skills: int
+    pengalaman_proyek: int
+    pemecahan_masalah: int
+    evaluasi_teks: str
+
+
+def _json_schema_format(name, model):
+    # Structured outputs: OpenAI menjamin JSON yang valid dan sesuai skema
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "schema": model.model_json_schema(),
+            "strict": True,
+        },
+    }
+
+
+QUIZ_RESPONSE_FORMAT = _json_schema_format("quiz", QuizSchema)
+HR_EVALUATION_FORMAT = _json_schema_format("hr_evaluation", HrEvaluation)
+TECH_EVALUATION_FORMAT = _json_schema_format("tech_evaluation", TechEvaluation)
+
+
+def _reset_interview(session, position, interview_type):
+    session["position"] = position
+    session["interview_type"] = interview_type
+    session["question_limit"] = QUESTION_LIMITS[interview_type]
+    # Satu string "Kandidat: ...\nHR: ...\n" per giliran
+    session["history"] = []
+    session["current_question_index"] = 0
+    session["evaluation_scores"] = {}
+    session["evaluation_text"] = ""
+    session["is_evaluation_done"] = False
+
+
+@functools.lru_cache(maxsize=256)
+def _system_message(position, interview_type):
+    # Hanya bergantung pada posisi & tipe wawancara, jadi dibangun sekali saja
+    return ChatMessage(
+        role=MessageRole.SYSTEM,
+        content=f"{SYSTEM_PROMPTS[interview_type]}\n\nPosisi: {position}",
+    )
+
+
+def _create_evaluation_prompt(position, interview_type, conversation_history):
+    return EVALUATION_PROMPTS[interview_type].format(
+        position=position, conversation_history=conversation_history
+    )
+
+
+def _evaluation_result(session):
+    return {
+        "status": "Evaluasi selesai",
+        "skor": session["evaluation_scores"],
+        "evaluasi_terperinci": session["evaluation_text"],
+    }
+
+
+def _record_turn(session, user_input, response_text):
+    session["history"].append(
+        CANDIDATE_PREFIX + user_input + "\n" + HR_PREFIX + response_text + "\n"
+    )
+    session["current_question_index"] += 1
+
+
+async def _record_stream(session, user_input, responses, on_done=None):
+    # Riwayat baru dicatat setelah seluruh token selesai di-stream
+    parts = []
+    async for response in responses:
+        if response.delta:
+            parts.append(response.delta)
+            yield response.delta
+    text = "".join(parts)
+    _record_turn(session, user_input, text)
+    if on_done is not None:
+        await on_done(text)
+
+
+async def _replay(session, user_input, text):
+    # Respons dari cache dikirim sebagai satu token
+    _record_turn(session, user_input, text)
+    yield text
+
+
+class CachedOpenAIEmbedding(OpenAIEmbedding):
+    """OpenAIEmbedding dengan cache LRU untuk embedding query.
+
+    Prompt pembuka dan quiz hanya bergantung pada posisi, jadi teks query yang
+    sama sering berulang dan tidak perlu di-embed ulang lewat API.
+    """
+
+    _query_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _cache_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _cached(self, query):
+        with self._cache_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+            return embedding
+
+    def _remember(self, query, embedding):
+        with self._cache_lock:
+            self._query_cache[query] = embedding
+            if len(self._query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
+    def _get_query_embedding(self, query):
+        embedding = self._cached(query)
+        if embedding is None:
+            embedding = super()._get_query_embedding(query)
+            self._remember(query, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query):
+        embedding = self._cached(query)
+        if embedding is None:
+            embedding = await super()._aget_query_embedding(query)
+            self._remember(query, embedding)
+        return embedding
+
+
+class ResponseCache:
+    """Cache LRU respons LLM yang hanya bergantung pada posisi & tipe wawancara.
+
+    Isinya disimpan ke file JSON supaya tetap terpakai setelah server restart.
+    File yang sama dipakai bersama oleh semua worker uvicorn, jadi setiap
+    penulisan menggabungkan isi file dulu di bawah ``flock``.
+    """
+
+    def __init__(self, path, max_size=RESPONSE_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._entries = OrderedDict(self._read())
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "rb") as f:
+            return orjson.loads(f.read())
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+        await asyncio.to_thread(self._write)
+
+    def _write(self):
+        with open(f"{self.path}.lock", "w") as lock_file:
+            # Entri dari worker lain yang belum ada di memori ditaruh sebagai
+            # yang paling lama, supaya tidak tertimpa oleh isi memori worker ini
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            on_disk = self._read()
+            with self._lock:
+                for key in reversed(on_disk):
+                    if key not in self._entries:
+                        self._entries[key] = on_disk[key]
+                        self._entries.move_to_end(key, last=False)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                data = orjson.dumps(self._entries)
+
+            # Tulis ke file sementara dulu supaya file cache tidak pernah setengah jadi
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+
 
 class RAGService:
     def __init__(self):
@@ -24,235 +388,322 @@ class RAGService:
             )
 
         Settings.llm = OpenAI(model="gpt-4o-mini", api_key=self.api_key)
-        self.embed_model = OpenAIEmbedding(
-            model="text-embedding-3-small", api_key=self.api_key
+        self.embed_model, self.embed_dim, index_suffix = self._create_embed_model()
+
+        # "simple" (bawaan llama-index), "faiss" (HNSW, butuh faiss-cpu) atau
+        # "qdrant" (server Qdrant, butuh qdrant-client)
+        self.vector_store = os.getenv("VECTOR_STORE", "simple").lower()
+        # Model, dimensi & tipe kuantisasi ada di nama direktori supaya index
+        # dengan format lain tidak ikut ter-load dan dibangun ulang
+        self.index_suffix = index_suffix
+        self.PERSIST_DIR = (
+            f"./storage_faiss_sq8_{index_suffix}"
+            if self.vector_store == "faiss"
+            else f"./storage_{index_suffix}"
         )
-
-        self.PERSIST_DIR = "./storage"
         self.index = self._load_or_create_index()
-        self.conversation_history = []
-        self.current_question_index = 0
-        self.position = ""
-        self.evaluation_scores = {}
-        self.evaluation_text = ""
-        self.is_evaluation_done = False
-        self.interview_type = "hr"
+        self.response_cache = ResponseCache(
+            os.getenv("RESPONSE_CACHE_PATH", "./response_cache.json")
+        )
+        # Giliran wawancara & evaluasi tidak butuh retrieval, jadi LLM dipanggil
+        # langsung tanpa embedding query dan pencarian vektor
+        self.llm = Settings.llm
+        # Evaluasi selalu berupa JSON sesuai skema, jadi cukup satu kali parse
+        # (diindeks dengan InterviewType)
+        self.evaluation_llms = tuple(
+            OpenAI(
+                model="gpt-4o-mini",
+                api_key=self.api_key,
+                additional_kwargs={"response_format": response_format},
+            )
+            for response_format in (HR_EVALUATION_FORMAT, TECH_EVALUATION_FORMAT)
+        )
+        self.quiz_engine = self.index.as_query_engine(
+            llm=OpenAI(
+                model="gpt-4o-mini",
+                api_key=self.api_key,
+                additional_kwargs={"response_format": QUIZ_RESPONSE_FORMAT},
+            ),
+            similarity_top_k=3,
+        )
+        # Konteks quiz untuk Batch API diambil manual karena LLM-nya di luar llama-index
+        self.quiz_retriever = self.index.as_retriever(similarity_top_k=3)
+
+    def _create_embed_model(self):
+        # "openai" (default), "huggingface" (model lokal) atau "tei" (server
+        # Text Embeddings Inference); model lokal tanpa network & rate limit
+        backend = os.getenv("EMBED_BACKEND", "openai").lower()
+        if backend == "openai":
+            # 100 chunk per request embedding saat membangun index
+            embed_model = CachedOpenAIEmbedding(
+                model="text-embedding-3-small",
+                api_key=self.api_key,
+                embed_batch_size=100,
+                dimensions=EMBED_DIM,
+            )
+            return embed_model, EMBED_DIM, str(EMBED_DIM)
+
+        model_name = os.getenv("LOCAL_EMBED_MODEL", LOCAL_EMBED_MODEL)
+        if backend == "huggingface":
+            import torch
+            from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+            embed_model = HuggingFaceEmbedding(
+                model_name=model_name,
+                embed_batch_size=64,
+                device="cuda" if torch.cuda.is_available() else "cpu",
+            )
+        elif backend == "tei":
+            from llama_index.embeddings.text_embeddings_inference import (
+                TextEmbeddingsInference,
+            )
+
+            embed_model = TextEmbeddingsInference(
+                model_name=model_name,
+                base_url=os.getenv("TEI_URL", "http://localhost:8080"),
+                embed_batch_size=64,
+            )
+        else:
+            raise ValueError(
+                f"Invalid EMBED_BACKEND '{backend}'. Must be 'openai', 'huggingface' or 'tei'."
+            )
+
+        # Dimensi tergantung model, jadi diambil dari satu embedding percobaan
+        embed_dim = len(embed_model.get_text_embedding("dimensi"))
+        return embed_model, embed_dim, f"{model_name.split('/')[-1]}_{embed_dim}"
+
+    def _load_embedded_nodes(self):
+        # VectorStoreIndex meng-embed batch satu per satu; di sini beberapa
+        # batch dikirim bersamaan, node yang sudah punya embedding dilewati index
+        documents = SimpleDirectoryReader("data").load_data()
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+        batch_size = self.embed_model.embed_batch_size
+        batches = [nodes[i : i + batch_size] for i in range(0, len(nodes), batch_size)]
+
+        def embed_batch(batch):
+            texts = [
+                node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch
+            ]
+            for node, embedding in zip(
+                batch, self.embed_model.get_text_embedding_batch(texts)
+            ):
+                node.embedding = embedding
+
+        with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+            # list() supaya error dari salah satu batch ikut dilempar
+            list(executor.map(embed_batch, batches))
+        return nodes
 
     def _load_or_create_index(self):
+        if self.vector_store == "faiss":
+            return self._load_or_create_faiss_index()
+        if self.vector_store == "qdrant":
+            return self._load_or_create_qdrant_index()
+
         if not os.path.exists(self.PERSIST_DIR):
-            documents = SimpleDirectoryReader("data").load_data()
-            index = VectorStoreIndex.from_documents(
-                documents, embed_model=self.embed_model
+            index = VectorStoreIndex(
+                self._load_embedded_nodes(),
+                embed_model=self.embed_model,
+                insert_batch_size=INSERT_BATCH_SIZE,
             )
             index.storage_context.persist(persist_dir=self.PERSIST_DIR)
         else:
             storage_context = StorageContext.from_defaults(persist_dir=self.PERSIST_DIR)
-            index = load_index_from_storage(storage_context)
+            index = load_index_from_storage(
+                storage_context, embed_model=self.embed_model
+            )
         return index
 
-    def create_system_prompt(self):
-        if self.interview_type == "hr":
-            return f"""
-            Nama anda adalah Mirai, seorang profesional HR yang berpengalaman dan sedang melakukan wawancara untuk posisi {self.position}.
-
-            Sebelumnya, Anda sudah melakukan opening dengan statement sebagai berikut "Terima kasih karena telah mempunyai ketertarikan pada perusahaan kami, Nama saya Mirai dari tim rekrutmen. Terima kasih sudah meluangkan waktu untuk mengikuti sesi wawancara ini. Kami sangat senang bisa mengenal Anda lebih dekat hari ini. Semoga kita bisa melalui sesi ini dengan lancar dan nyaman. Jika ada hal yang ingin ditanyakan selama wawancara, jangan ragu untuk mengatakannya. Mari kita mulai dengan perkenalan diri anda secara kreatif"
-            Jadi, tolong lanjutkan sesuai dengan konteks dan hasil dari jawaban kandidat sebagai "PERTANYAAN KEDUA"
-
-            Ikuti panduan berikut:
-            1. Berikan respons singkat dan relevan terhadap jawaban kandidat.
-            2. Ajukan satu pertanyaan pada satu waktu, yang relevan dengan posisi {self.position}.
-            3. Pastikan untuk mencakup pertanyaan tentang:
-            - Motivasi kandidat
-            - Technical skills yang relevan dengan posisi {self.position}
-            - Pengalaman proyek yang relevan dengan posisi {self.position}
-            - Kemampuan pemecahan masalah
-            - Kecocokan budaya kerja
-            4. Gunakan konteks dari jawaban sebelumnya untuk membuat pertanyaan yang relevan.
-            5. Pertahankan nada profesional sepanjang wawancara.
-            6. Setelah 5 pertanyaan, berikan evaluasi yang sejujur-jujurnya mengenai jawaban kandidat, apakah sudah sesuai dengan STAR method, dan apakah kandidat sesuai dengan posisi {self.position}.
-            """
-        elif self.interview_type == "tech":
-            return f"""
-            Nama anda adalah Mirai, Anda adalah seorang User pada suatu perusahaan yang sedang melakukan wawancara teknis yang sedang melakukan wawancara untuk posisi {self.position}.
-
-            Sebelumnya, Anda sudah melakukan opening dengan statement sebagai berikut "Terima kasih karena telah mempunyai ketertarikan pada perusahaan kami, Nama saya Mirai dari tim rekrutmen. Terima kasih sudah meluangkan waktu untuk mengikuti sesi wawancara ini. Kami sangat senang bisa mengenal Anda lebih dekat hari ini. Semoga kita bisa melalui sesi ini dengan lancar dan nyaman. Jika ada hal yang ingin ditanyakan selama wawancara, jangan ragu untuk mengatakannya. Mari kita mulai dengan perkenalan diri anda secara kreatif"
-            Jadi, tolong lanjutkan sesuai dengan konteks dan hasil dari jawaban kandidat sebagai "PERTANYAAN KEDUA"
-
-            Ajukan 3 pertanyaan teknis terkait posisi ini. Berikut adalah contoh pertanyaan yang bisa Anda ajukan untuk beberapa posisi:
-            - Software Engineer: Gimana cara anda melakukan caching, bagaimana cara anda untuk melakukan API versioning.
-            - Data Engineer: Bagaimana Anda melakukan data modeling, strategi pipeline data.
-
-            Ikuti panduan berikut:
-            1. Berikan respons singkat terhadap jawaban kandidat.
-            2. Ajukan pertanyaan yang relevan satu per satu sesuai dengan konteks dari jawaban sebelumnya.
-            3. Setelah 3 pertanyaan, lakukan evaluasi kandidat berdasarkan jawaban mereka.
-
-            Pertahankan nada profesional sepanjang wawancara.
-            """
-
-    def create_evaluation_prompt(self, conversation_history):
-        if self.interview_type == "hr":
-            return f"""
-                Anda telah melakukan wawancara dengan kandidat untuk posisi {self.position}. Berdasarkan jawaban-jawaban kandidat berikut:
-
-                {conversation_history}
-
-                Berikan penilaian dalam bentuk angka 1-10 untuk masing-masing aspek berikut ini:
-                1. Motivasi kandidat
-                2. Technical skills yang relevan dengan posisi {self.position}
-                3. Pengalaman proyek yang relevan dengan posisi {self.position}
-                4. Kemampuan pemecahan masalah
-                5. Kecocokan budaya kerja
-
-                Jangan terlalu baik dalam memberikan skor jika memang dia belum kompeten/baru belajar, karena ini untuk pekerja professional. Selain memberikan skor, buatlah evaluasi singkat dalam bentuk teks untuk masing-masing aspek di atas. Evaluasi harus mencakup hal-hal positif serta area yang dapat ditingkatkan, dan berikan saran yang membantu kandidat dalam pengembangan lebih lanjut.
-
-                Format output yang diinginkan:
-                {{
-                    "motivasi": nilai_1_sampai_10,
-                    "technical_skills": nilai_1_sampai_10,
-                    "pengalaman_proyek": nilai_1_sampai_10,
-                    "pemecahan_masalah": nilai_1_sampai_10,
-                    "kecocokan_budaya": nilai_1_sampai_10,
-                    "evaluasi_teks": "Evaluasi & saran untuk kandidat ke depan."
-                }}
-                """
-        elif self.interview_type == "tech":
-            return f"""
-                Anda telah melakukan wawancara teknis dengan kandidat untuk posisi {self.position}. Berdasarkan jawaban-jawaban kandidat berikut:
-
-                {conversation_history}
-
-                Berikan penilaian dalam bentuk angka 1-10 untuk masing-masing aspek berikut ini:
-                1. Technical skills yang relevan dengan posisi {self.position}
-                2. Pengalaman proyek yang relevan dengan posisi {self.position}
-                3. Kemampuan pemecahan masalah
-
-                Jangan terlalu baik dalam memberikan skor jika memang dia belum kompeten/baru belajar, karena ini untuk pekerja professional. Selain memberikan skor, buatlah evaluasi singkat dalam bentuk teks untuk masing-masing aspek di atas. Evaluasi harus mencakup hal-hal positif serta area yang dapat ditingkatkan, dan berikan saran yang membantu kandidat dalam pengembangan lebih lanjut.
-
-                Format output yang diinginkan:
-                {{
-                    "technical_skills": nilai_1_sampai_10,
-                    "pengalaman_proyek": nilai_1_sampai_10,
-                    "pemecahan_masalah": nilai_1_sampai_10,
-                    "evaluasi_teks": "Evaluasi & saran untuk kandidat ke depan."
-                }}
-                """
-
-    def get_ai_response(self, user_input, position, interview_type="hr"):
-        if self.position != position or self.interview_type != interview_type:
-            self.position = position
-            self.interview_type = interview_type
-            self.conversation_history = []
-            self.current_question_index = 0
-            self.is_evaluation_done = False
-
-        query_engine = self.index.as_query_engine(llm=Settings.llm)
-        system_prompt = self.create_system_prompt()
-
-        full_context = "\n".join(
-            self.conversation_history + [f"Kandidat: {user_input}"]
-        )
+    def _load_or_create_faiss_index(self):
+        import faiss
+        from llama_index.vector_stores.faiss import FaissVectorStore
 
-        # Limit untuk HR interview = 5, untuk Technical 3
-        question_limit = 5 if self.interview_type == "hr" else 3
+        if not os.path.exists(self.PERSIST_DIR):
+            nodes = self._load_embedded_nodes()
+            # Embedding OpenAI sudah ternormalisasi, jadi jarak L2 HNSW
+            # menghasilkan urutan yang sama dengan cosine similarity. Vektor
+            # disimpan sebagai int8 (1 byte per dimensi), skala per dimensi
+            # dilatih dari embedding dokumen
+            faiss_index = faiss.IndexHNSWSQ(
+                self.embed_dim, faiss.ScalarQuantizer.QT_8bit, 32
+            )
+            faiss_index.train(
+                np.array([node.embedding for node in nodes], dtype=np.float32)
+            )
+            vector_store = FaissVectorStore(faiss_index=faiss_index)
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+            index = VectorStoreIndex(
+                nodes,
+                storage_context=storage_context,
+                embed_model=self.embed_model,
+                insert_batch_size=INSERT_BATCH_SIZE,
+            )
+            index.storage_context.persist(persist_dir=self.PERSIST_DIR)
+        else:
+            vector_store = FaissVectorStore.from_persist_dir(self.PERSIST_DIR)
+            storage_context = StorageContext.from_defaults(
+                vector_store=vector_store, persist_dir=self.PERSIST_DIR
+            )
+            index = load_index_from_storage(
+                storage_context, embed_model=self.embed_model
+            )
+        return index
 
-        if self.is_evaluation_done:
-            return {
-                "status": "Evaluasi selesai",
-                "skor": self.evaluation_scores,
-                "evaluasi_terperinci": self.evaluation_text,
-            }
+    def _load_or_create_qdrant_index(self):
+        import qdrant_client
+        from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+        url = os.getenv("QDRANT_URL", "http://localhost:6333")
+        collection_name = os.getenv("QDRANT_COLLECTION", f"mirai_{self.index_suffix}")
+        client = qdrant_client.QdrantClient(url=url)
+        # Client async dipakai oleh aquery/aretrieve (quiz)
+        vector_store = QdrantVectorStore(
+            collection_name=collection_name,
+            client=client,
+            aclient=qdrant_client.AsyncQdrantClient(url=url),
+        )
 
-        if not self.conversation_history:
-            # Ajukan pertanyaan pertama
-            response = query_engine.query(
-                f"{system_prompt}\n\nBerikan sambutan singkat dan ajukan pertanyaan pertama yang relevan untuk posisi {self.position}."
+        # Vektor disimpan oleh Qdrant sendiri, jadi tidak ada persist_dir
+        if client.collection_exists(collection_name):
+            return VectorStoreIndex.from_vector_store(
+                vector_store, embed_model=self.embed_model
             )
 
-        elif self.current_question_index < question_limit:
-            # Ajukan pertanyaan berikutnya jika belum mencapai batas pertanyaan
-            response = query_engine.query(
-                f"{system_prompt}\n\nKonteks percakapan:\n{full_context}\n\nBerikan respons singkat dan ajukan pertanyaan berikutnya yang relevan untuk posisi {self.position}."
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        return VectorStoreIndex(
+            self._load_embedded_nodes(),
+            storage_context=storage_context,
+            embed_model=self.embed_model,
+            insert_batch_size=INSERT_BATCH_SIZE,
+        )
+
+    async def get_ai_response(
+        self,
+        user_input,
+        session,
+        position,
+        interview_type=InterviewType.HR,
+        streaming=False,
+    ):
+        # State wawancara per user ada di session, RAGService sendiri stateless
+        if (
+            session.get("position") != position
+            or session.get("interview_type") != interview_type
+        ):
+            _reset_interview(session, position, interview_type)
+
+        system_message = _system_message(position, interview_type)
+        history = session["history"]
+        current_answer = CANDIDATE_PREFIX + user_input
+
+        if session["is_evaluation_done"]:
+            return _evaluation_result(session)
+
+        if not history:
+            # Pertanyaan pertama hanya bergantung pada posisi & tipe wawancara
+            cache_key = f"opening:{interview_type.name.lower()}:{position}"
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                if streaming:
+                    return _replay(session, user_input, cached)
+                _record_turn(session, user_input, cached)
+                return cached
+
+            if streaming:
+                response = await self.llm.astream_chat(
+                    [system_message, ChatMessage(content=OPENING_INSTRUCTION)]
+                )
+                return _record_stream(
+                    session,
+                    user_input,
+                    response,
+                    on_done=functools.partial(self.response_cache.set, cache_key),
+                )
+
+            response = await self.llm.achat(
+                [system_message, ChatMessage(content=OPENING_INSTRUCTION)]
             )
+            text = response.message.content
+            await self.response_cache.set(cache_key, text)
+            _record_turn(session, user_input, text)
+            return text
+
+        elif session["current_question_index"] < session["question_limit"]:
+            # Ajukan pertanyaan berikutnya jika belum mencapai batas pertanyaan.
+            # Hanya beberapa giliran terakhir yang dikirim supaya prompt tidak
+            # terus membesar di setiap giliran
+            recent_context = "".join(history[-HISTORY_WINDOW:]) + current_answer
+            messages = [
+                system_message,
+                ChatMessage(
+                    content=f"Konteks percakapan:\n{recent_context}\n\n{NEXT_QUESTION_INSTRUCTION}"
+                ),
+            ]
         else:
             # Setelah jumlah pertanyaan yang ditentukan, buat prompt evaluasi
-            evaluation_prompt = self.create_evaluation_prompt(full_context)
-            evaluation_response = query_engine.query(evaluation_prompt)
+            # dari seluruh riwayat wawancara
+            evaluation_prompt = _create_evaluation_prompt(
+                position, interview_type, "".join(history) + current_answer
+            )
+            evaluation_llm = self.evaluation_llms[interview_type]
+            evaluation_response = await evaluation_llm.acomplete(evaluation_prompt)
 
             try:
-                evaluation_data = json.loads(evaluation_response.response)
-                if self.interview_type == "hr":
-                    self.evaluation_scores = {
-                        "motivasi": evaluation_data["motivasi"],
-                        "technical_skills": evaluation_data["technical_skills"],
-                        "pengalaman_proyek": evaluation_data["pengalaman_proyek"],
-                        "pemecahan_masalah": evaluation_data["pemecahan_masalah"],
-                        "kecocokan_budaya": evaluation_data["kecocokan_budaya"],
-                    }
-                else:
-                    self.evaluation_scores = {
-                        "technical_skills": evaluation_data["technical_skills"],
-                        "pengalaman_proyek": evaluation_data["pengalaman_proyek"],
-                        "pemecahan_masalah": evaluation_data["pemecahan_masalah"],
-                    }
-                self.evaluation_text = evaluation_data["evaluasi_teks"]
-                self.is_evaluation_done = True
-
-            except json.JSONDecodeError as e:
+                # Skema hanya berisi skor + evaluasi_teks, urutannya sesuai skema
+                evaluation_data = orjson.loads(evaluation_response.text)
+                session["evaluation_text"] = evaluation_data.pop("evaluasi_teks")
+                session["evaluation_scores"] = evaluation_data
+                session["is_evaluation_done"] = True
+
+            except orjson.JSONDecodeError as e:
                 print(f"Error parsing evaluation response: {e}")
 
-            return {
-                "status": "Evaluasi selesai",
-                "skor": self.evaluation_scores,
-                "evaluasi_terperinci": self.evaluation_text,
-            }
+            return _evaluation_result(session)
 
-        self.conversation_history.append(f"Kandidat: {user_input}")
-        self.conversation_history.append(f"HR: {response.response}")
+        if streaming:
+            response = await self.llm.astream_chat(messages)
+            return _record_stream(session, user_input, response)
 
-        self.current_question_index += 1
+        response = await self.llm.achat(messages)
+        _record_turn(session, user_input, response.message.content)
+        return response.message.content
 
-        return response.response
+    def cached_quiz(self, position):
+        return self.response_cache.get(f"quiz:{position}")
 
-    def generate_quiz(self, position):
-        quiz_prompt = f"""
-        Anda adalah seorang profesional di bidang {position} yang sedang merancang 10 pertanyaan quiz teknikal untuk posisi {position}.
-        Pertanyaan-pertanyaan ini harus relevan dengan keterampilan teknis yang dibutuhkan untuk posisi ini, mencakup berbagai aspek teknis terkait.
+    async def cache_quiz(self, position, quiz_data):
+        await self.response_cache.set(f"quiz:{position}", quiz_data)
 
-        Format hasil yang diinginkan adalah JSON dengan struktur berikut:
+    async def quiz_batch_prompt(self, position):
+        quiz_prompt = QUIZ_PROMPT.format(position=position)
+        nodes = await self.quiz_retriever.aretrieve(quiz_prompt)
+        context = "\n\n".join(node.get_content() for node in nodes)
+        return f"Konteks:\n{context}\n\n{quiz_prompt}"
 
-        ```json
-        {{
-          "quiz": [
-            {{
-              "question": "Pertanyaan 1",
-              "options": ["Opsi A", "Opsi B", "Opsi C", "Opsi D"],
-              "answer": "Jawaban yang benar"
-            }},
-            ...
-          ]
-        }}
-        ```
+    async def generate_quiz(self, position):
+        cached = self.cached_quiz(position)
+        if cached is not None:
+            return cached
 
-        Harap buat 10 pertanyaan dengan format yang disebutkan di atas.
-        """
+        quiz_prompt = QUIZ_PROMPT.format(position=position)
 
-        response = self.index.as_query_engine(llm=Settings.llm).query(quiz_prompt)
+        response = await self.quiz_engine.aquery(quiz_prompt)
 
         try:
-            start_index = response.response.find("{")
-            end_index = response.response.rfind("}") + 1
-            json_str = response.response[start_index:end_index]
-
-            quiz_data = json.loads(json_str)
+            quiz_data = orjson.loads(response.response)
+            await self.cache_quiz(position, quiz_data)
 
             return quiz_data
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Failed to parse JSON from AI response: {e}")
 
         except Exception as e:
             raise ValueError(f"An error occurred while generating the quiz: {e}")
 
 
-rag_service = RAGService()
+@functools.lru_cache(maxsize=None)
+def get_rag_service():
+    # Dibuat saat pertama dipakai (startup FastAPI), bukan saat modul diimport,
+    # supaya import tidak butuh OPENAI_API_KEY atau menunggu index dibangun
+    return RAGService()
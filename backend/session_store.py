@@ -0,0 +1,113 @@
+import copy
+import logging
+import time
+from collections import OrderedDict
+
+import orjson
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+
+def new_session():
+    # Field wawancara (riwayat, indeks pertanyaan, evaluasi) diisi oleh
+    # RAGService saat giliran pertama untuk posisi & tipe wawancara tertentu
+    return {
+        "position": None,
+        "interview_type": None,
+        "timestamp": time.time(),
+    }
+
+
+class InMemorySessionStore:
+    """Session di memori proses, hanya konsisten untuk satu worker uvicorn."""
+
+    def __init__(self, expiry, max_sessions=10_000):
+        self.expiry = expiry
+        self.max_sessions = max_sessions
+        # Diurutkan dari yang paling lama tidak aktif (lihat move_to_end)
+        self._sessions = OrderedDict()
+        self._file_names = {}
+
+    async def get(self, user_id):
+        # Salinan, sama seperti Redis: perubahan session baru tersimpan lewat
+        # save(), jadi giliran yang gagal di tengah jalan tidak ikut tercatat
+        session = self._sessions.get(user_id)
+        return copy.deepcopy(session) if session is not None else None
+
+    async def exists(self, user_id):
+        return user_id in self._sessions
+
+    async def save(self, user_id, session):
+        session["timestamp"] = time.time()
+        self._sessions[user_id] = copy.deepcopy(session)
+        self._sessions.move_to_end(user_id)
+        self._file_names.setdefault(user_id, set())
+
+        if len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            self._file_names.pop(evicted, None)
+
+    async def add_file(self, user_id, filename):
+        self._file_names.setdefault(user_id, set()).add(filename)
+
+    async def has_file(self, user_id, filename):
+        return filename in self._file_names.get(user_id, ())
+
+    def cleanup_expired(self):
+        current_time = time.time()
+        while self._sessions:
+            userid, session = next(iter(self._sessions.items()))
+            if current_time - session["timestamp"] <= self.expiry:
+                break
+            self._sessions.popitem(last=False)
+            self._file_names.pop(userid, None)
+            logger.info(f"Session for userid {userid} expired and was removed.")
+
+
+class RedisSessionStore:
+    """Session di Redis supaya bisa dipakai bersama oleh banyak worker.
+
+    Session disimpan sebagai JSON di ``sess:{id}`` (SETEX) dan nama file audio
+    sebagai set ``sess:{id}:files``. Keduanya memakai TTL, jadi tidak perlu
+    cleanup manual.
+    """
+
+    def __init__(self, url, expiry):
+        self.expiry = expiry
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(user_id):
+        return f"sess:{user_id}"
+
+    async def get(self, user_id):
+        raw = await self.redis.get(self._key(user_id))
+        if raw is None:
+            return None
+        return orjson.loads(raw)
+
+    async def exists(self, user_id):
+        return bool(await self.redis.exists(self._key(user_id)))
+
+    async def save(self, user_id, session):
+        session["timestamp"] = time.time()
+        key = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.setex(key, self.expiry, orjson.dumps(session))
+            pipe.expire(f"{key}:files", self.expiry)
+            await pipe.execute()
+
+    async def add_file(self, user_id, filename):
+        key = f"{self._key(user_id)}:files"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(key, filename)
+            pipe.expire(key, self.expiry)
+            await pipe.execute()
+
+    async def has_file(self, user_id, filename):
+        return bool(await self.redis.sismember(f"{self._key(user_id)}:files", filename))
+
+    def cleanup_expired(self):
+        # Redis menghapus key yang expired sendiri lewat TTL
+        pass